@@ -1,14 +1,94 @@
+import asyncio
 import datetime
+import functools
+import gzip
 import logging.config
 from environs import Env
 from seller import download_stock
 
+import orjson
+import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from seller import divide, price_conversion
 
 logger = logging.getLogger(__file__)
 
+ENDPOINT_URL = "https://api.partner.market.yandex.ru/"
+
+# Специальные значения колонки "Количество" из файла остатков
+_STOCK_MAP = {">10": 100, "1": 0}
+
+# Общая сессия с пулом keep-alive соединений. HTTP/1.1 через requests
+# выбран сознательно: политика повторов (Retry-After, backoff) опирается
+# на urllib3, а параллелизм обеспечивают потоки в upload_*.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET", "PUT", "POST"],
+            respect_retry_after_header=True,
+        ),
+    ),
+)
+
+
+def _call_market_api(method, path, access_token, params=None, payload=None):
+    """
+
+    Выполнить запрос к API яндекс маркета и вернуть разобранный ответ.
+
+    Args:
+        method (str): HTTP метод запроса ("GET", "PUT", "POST")
+        path (str): Путь запроса относительно ENDPOINT_URL
+        access_token (str): Уникальный ключ продавца для доступа к API
+        params (dict): Параметры строки запроса
+        payload (dict): Тело запроса, сериализуется в JSON
+
+    Returns:
+        dict: Возвращает словарь с ответом API.
+
+    Raises:
+        requests.exceptions.HTTPError: Если запрос завершился с ошибкой (например,
+                                        код ответа 4xx или 5xx).
+
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {access_token}",
+        "Accept": "application/json",
+        "Host": "api.partner.market.yandex.ru",
+    }
+    data = None
+    if payload is not None:
+        # Тела запросов из повторяющихся JSON-полей сжимаются в 5-10 раз;
+        # уровень 1 почти не нагружает процессор
+        data = gzip.compress(orjson.dumps(payload), compresslevel=1)
+        headers["Content-Encoding"] = "gzip"
+    response = _SESSION.request(
+        method, ENDPOINT_URL + path, headers=headers, params=params, data=data
+    )
+    if response.status_code == 415 and payload is not None:
+        # Сервер не принял сжатое тело — повторим без сжатия
+        del headers["Content-Encoding"]
+        response = _SESSION.request(
+            method,
+            ENDPOINT_URL + path,
+            headers=headers,
+            params=params,
+            data=orjson.dumps(payload),
+        )
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
 
 def get_product_list(page, campaign_id, access_token):
     """
@@ -57,21 +137,12 @@ def get_product_list(page, campaign_id, access_token):
         https://api.partner.market.yandex.ru/campaigns/"ваш_campaign_id"/offer-mapping-entries
 
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
-    payload = {
-        "page_token": page,
-        "limit": 200,
-    }
-    url = endpoint_url + f"campaigns/{campaign_id}/offer-mapping-entries"
-    response = requests.get(url, headers=headers, params=payload)
-    response.raise_for_status()
-    response_object = response.json()
+    response_object = _call_market_api(
+        "GET",
+        f"campaigns/{campaign_id}/offer-mapping-entries",
+        access_token,
+        params={"page_token": page, "limit": 200},
+    )
     return response_object.get("result")
 
 
@@ -109,19 +180,12 @@ def update_stocks(stocks, campaign_id, access_token):
         https://api.partner.market.yandex.ru/campaigns/"ваш_campaign_id"/offers/stocks
 
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
-    payload = {"skus": stocks}
-    url = endpoint_url + f"campaigns/{campaign_id}/offers/stocks"
-    response = requests.put(url, headers=headers, json=payload)
-    response.raise_for_status()
-    response_object = response.json()
-    return response_object
+    return _call_market_api(
+        "PUT",
+        f"campaigns/{campaign_id}/offers/stocks",
+        access_token,
+        payload={"skus": stocks},
+    )
 
 
 def update_price(prices, campaign_id, access_token):
@@ -159,19 +223,82 @@ def update_price(prices, campaign_id, access_token):
         https://api.partner.market.yandex.ru/campaigns/"ваш_campaign_id"/offer-prices/updates
 
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
-    payload = {"offers": prices}
-    url = endpoint_url + f"campaigns/{campaign_id}/offer-prices/updates"
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    response_object = response.json()
-    return response_object
+    return _call_market_api(
+        "POST",
+        f"campaigns/{campaign_id}/offer-prices/updates",
+        access_token,
+        payload={"offers": prices},
+    )
+
+
+def get_stocks(campaign_id, access_token, offer_ids):
+    """
+
+    Получить текущие остатки товаров с яндекс маркета.
+
+    Args:
+        campaign_id (str): Уникальный номер магазина
+        access_token (str): Уникальный ключ продавца для доступа к API
+        offer_ids (list): Список артикулов товаров с яндекс маркета
+
+    Returns:
+        dict: Возвращает словарь, где ключ — артикул товара, а значение —
+        его текущий остаток на складах.
+
+    Raises:
+        requests.exceptions.HTTPError: Если запрос завершился с ошибкой (например,
+                                        код ответа 4xx или 5xx).
+
+    Examples:
+        >>> campaign_id = "ваш_campaign_id"
+        >>> access_token = "ваш_market_token"
+        >>> offer_ids = get_offer_ids(campaign_id, access_token)
+        >>> get_stocks(campaign_id, access_token, offer_ids)
+        {"136748": 6, "136749": 100, "136750": 0, ....}
+
+    """
+    current_stocks = {}
+    # API принимает не больше 500 артикулов за запрос
+    for some_ids in divide(list(offer_ids), 500):
+        response_object = _call_market_api(
+            "POST",
+            f"campaigns/{campaign_id}/stats/skus",
+            access_token,
+            payload={"shopSkus": some_ids},
+        )
+        for sku in response_object.get("result").get("shopSkus"):
+            count = 0
+            for warehouse in sku.get("warehouses") or []:
+                for stock in warehouse.get("stocks") or []:
+                    if stock.get("type") == "AVAILABLE":
+                        count += stock.get("count")
+            current_stocks[sku.get("shopSku")] = count
+    return current_stocks
+
+
+def _iter_products(campaign_id, market_token):
+    """
+
+    Постранично получить товары магазина с яндекс маркета.
+
+    Args:
+        campaign_id (str): Уникальный номер магазина
+        market_token (str): Уникальный ключ продавца для доступа к API
+
+    Yields:
+        dict: Словарь с информацией об очередном товаре
+
+    """
+    page = ""
+    # Страницы запрашиваются строго по очереди: nextPageToken следующей
+    # страницы приходит только в ответе на предыдущую, поэтому загрузить
+    # несколько страниц параллельно нельзя.
+    while True:
+        some_prod = get_product_list(page, campaign_id, market_token)
+        yield from some_prod.get("offerMappingEntries")
+        page = some_prod.get("paging").get("nextPageToken")
+        if not page:
+            break
 
 
 def get_offer_ids(campaign_id, market_token):
@@ -204,18 +331,31 @@ def get_offer_ids(campaign_id, market_token):
         https://api.partner.market.yandex.ru/campaigns/"ваш_campaign_id"/offer-mapping-entries
 
     """
-    page = ""
-    product_list = []
-    while True:
-        some_prod = get_product_list(page, campaign_id, market_token)
-        product_list.extend(some_prod.get("offerMappingEntries"))
-        page = some_prod.get("paging").get("nextPageToken")
-        if not page:
-            break
-    offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer").get("shopSku"))
-    return offer_ids
+    return [
+        product.get("offer").get("shopSku")
+        for product in _iter_products(campaign_id, market_token)
+    ]
+
+
+@functools.lru_cache(maxsize=256)
+def _make_items(count, date):
+    """
+
+    Собрать блок items для записи об остатке товара.
+
+    Результат кэшируется по паре (количество, дата): различных количеств
+    немного, поэтому строки с одинаковым остатком разделяют один и тот же
+    объект. Возвращаемое значение нельзя изменять.
+
+    Args:
+        count (int): Остаток товара на складе
+        date (str): Дата обновления остатка в формате ISO 8601
+
+    Returns:
+        list: Возвращает список с одним словарём items для API.
+
+    """
+    return [{"count": count, "type": "FIT", "updatedAt": date}]
 
 
 def create_stocks(watch_remnants, offer_ids, warehouse_id):
@@ -271,43 +411,36 @@ def create_stocks(watch_remnants, offer_ids, warehouse_id):
     """
     # Уберем то, что не загружено в market
     stocks = list()
-    date = str(datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z")
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append(
-                {
-                    "sku": str(watch.get("Код")),
-                    "warehouseId": warehouse_id,
-                    "items": [
-                        {
-                            "count": stock,
-                            "type": "FIT",
-                            "updatedAt": date,
-                        }
-                    ],
-                }
-            )
-            offer_ids.remove(str(watch.get("Код")))
+    date = datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+    offer_set = set(map(str, offer_ids))
+    seen = set()
+    if watch_remnants:
+        frame = pd.DataFrame(watch_remnants)
+        codes = frame["Код"].astype(str)
+        frame = frame[codes.isin(offer_set)]
+        counts = frame["Количество"].astype(str)
+        counted = (
+            counts.map(_STOCK_MAP)
+            .fillna(pd.to_numeric(counts, errors="coerce"))
+            .fillna(0)
+            .astype(int)
+        )
+        stocks = [
+            {
+                "sku": code,
+                "warehouseId": warehouse_id,
+                "items": _make_items(int(stock), date),
+            }
+            for code, stock in zip(codes[frame.index], counted)
+        ]
+        seen = set(codes[frame.index])
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
+    for offer_id in offer_set - seen:
         stocks.append(
             {
                 "sku": offer_id,
                 "warehouseId": warehouse_id,
-                "items": [
-                    {
-                        "count": 0,
-                        "type": "FIT",
-                        "updatedAt": date,
-                    }
-                ],
+                "items": _make_items(0, date),
             }
         )
     return stocks
@@ -351,35 +484,56 @@ def create_prices(watch_remnants, offer_ids):
         []
         
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "id": str(watch.get("Код")),
-                # "feed": {"id": 0},
-                "price": {
-                    "value": int(price_conversion(watch.get("Цена"))),
-                    # "discountBase": 0,
-                    "currencyId": "RUR",
-                    # "vat": 0,
-                },
-                # "marketSku": 0,
-                # "shopSku": "string",
-            }
-            prices.append(price)
-    return prices
+    if not watch_remnants:
+        return []
+    offer_set = set(map(str, offer_ids))
+    frame = pd.DataFrame(watch_remnants)
+    codes = frame["Код"].astype(str)
+    frame = frame[codes.isin(offer_set)]
+    values = frame["Цена"].map(price_conversion)
+    return [
+        {
+            "id": code,
+            "price": {
+                "value": int(value),
+                "currencyId": "RUR",
+            },
+        }
+        for code, value in zip(codes[frame.index], values)
+    ]
+
+
+async def _bounded_call(semaphore, func, *args):
+    """
+
+    Выполнить блокирующую функцию в отдельном потоке, ограничив количество
+    одновременных вызовов семафором.
 
+    Args:
+        semaphore (asyncio.Semaphore): Ограничитель одновременных запросов
+        func (callable): Блокирующая функция для выполнения
+        *args: Аргументы, передаваемые в функцию
+
+    Returns:
+        Возвращает результат вызова функции func
 
-async def upload_prices(watch_remnants, campaign_id, market_token):
+    """
+    async with semaphore:
+        return await asyncio.to_thread(func, *args)
+
+
+async def upload_prices(watch_remnants, campaign_id, market_token, offer_ids=None):
     """
     
     Асинхронная функция, предназначена для загрузки цен
     
     Args:
         watch_remnants (list): Cписок словарей, содержащий данные о товарах
-        campaign_id (str): Уникальный номер магазина 
+        campaign_id (str): Уникальный номер магазина
         market_token (str): Уникальный ключ продавца для доступа к API
-    
+        offer_ids (list): Список артикулов товаров, если не передан —
+            запрашивается у API
+
     Returns:
         list: Возвращает список словарей, содержащий информацию о цене товара
 
@@ -411,15 +565,23 @@ async def upload_prices(watch_remnants, campaign_id, market_token):
         []
 
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
+    if offer_ids is None:
+        offer_ids = get_offer_ids(campaign_id, market_token)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_prices in list(divide(prices, 500)):
-        update_price(some_prices, campaign_id, market_token)
+    semaphore = asyncio.Semaphore(8)
+    await asyncio.gather(
+        *(
+            _bounded_call(semaphore, update_price, some_prices, campaign_id, market_token)
+            for some_prices in divide(prices, 500)
+        )
+    )
     return prices
 
 
 
-async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id):
+async def upload_stocks(
+    watch_remnants, campaign_id, market_token, warehouse_id, offer_ids=None
+):
     """
     
     Асинхронная функция, предназначена для загрузки обновленного количества товаров
@@ -429,6 +591,8 @@ async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id)
         campaign_id (str): Уникальный номер магазина 
         market_token (str): Уникальный ключ продавца для доступа к API
         warehouse_id (str): Уникальный номер склада, где хранится ваш товар
+        offer_ids (list): Список артикулов товаров, если не передан —
+            запрашивается у API
 
     Returns:
         list: Возвращает список словарей, содержащий артикли товаров, их остатки,
@@ -508,16 +672,50 @@ async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id)
         [], []
 
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
+    if offer_ids is None:
+        offer_ids = get_offer_ids(campaign_id, market_token)
     stocks = create_stocks(watch_remnants, offer_ids, warehouse_id)
-    for some_stock in list(divide(stocks, 2000)):
-        update_stocks(some_stock, campaign_id, market_token)
-    not_empty = list(
-        filter(lambda stock: (stock.get("items")[0].get("count") != 0), stocks)
+    # Отправляем только изменившиеся остатки
+    current_stocks = await asyncio.to_thread(
+        get_stocks, campaign_id, market_token, offer_ids
     )
+    changed = [
+        stock
+        for stock in stocks
+        if current_stocks.get(stock["sku"]) != stock["items"][0]["count"]
+    ]
+    semaphore = asyncio.Semaphore(8)
+    await asyncio.gather(
+        *(
+            _bounded_call(semaphore, update_stocks, some_stock, campaign_id, market_token)
+            for some_stock in divide(changed, 2000)
+        )
+    )
+    not_empty = [stock for stock in stocks if stock["items"][0]["count"] != 0]
     return not_empty, stocks
 
 
+async def _process_campaign(watch_remnants, campaign_id, market_token, warehouse_id):
+    """
+
+    Обновить остатки и цены товаров одной кампании.
+
+    Args:
+        watch_remnants (list): Cписок словарей, содержащий данные о товарах
+        campaign_id (str): Уникальный номер магазина
+        market_token (str): Уникальный ключ продавца для доступа к API
+        warehouse_id (str): Уникальный номер склада, где хранится ваш товар
+
+    """
+    offer_ids = await asyncio.to_thread(get_offer_ids, campaign_id, market_token)
+    # Обновить остатки
+    await upload_stocks(
+        watch_remnants, campaign_id, market_token, warehouse_id, offer_ids
+    )
+    # Поменять цены
+    await upload_prices(watch_remnants, campaign_id, market_token, offer_ids)
+
+
 def main():
     env = Env()
     market_token = env.str("MARKET_TOKEN")
@@ -527,24 +725,25 @@ def main():
     warehouse_dbs_id = env.str("WAREHOUSE_DBS_ID")
 
     watch_remnants = download_stock()
+    if not watch_remnants:
+        # Файл остатков пуст — без него create_stocks обнулила бы остатки
+        # всех товаров магазина
+        print("Файл остатков пуст, обновление не требуется")
+        return
     try:
-        # FBS
-        offer_ids = get_offer_ids(campaign_fbs_id, market_token)
-        # Обновить остатки FBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_fbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_fbs_id, market_token)
-        # Поменять цены FBS
-        upload_prices(watch_remnants, campaign_fbs_id, market_token)
-
-        # DBS
-        offer_ids = get_offer_ids(campaign_dbs_id, market_token)
-        # Обновить остатки DBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_dbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_dbs_id, market_token)
-        # Поменять цены DBS
-        upload_prices(watch_remnants, campaign_dbs_id, market_token)
+
+        async def _run():
+            # Кампании FBS и DBS независимы, обновляем их параллельно
+            await asyncio.gather(
+                _process_campaign(
+                    watch_remnants, campaign_fbs_id, market_token, warehouse_fbs_id
+                ),
+                _process_campaign(
+                    watch_remnants, campaign_dbs_id, market_token, warehouse_dbs_id
+                ),
+            )
+
+        asyncio.run(_run())
     except requests.exceptions.ReadTimeout:
         print("Превышено время ожидания...")
     except requests.exceptions.ConnectionError as error:
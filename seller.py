@@ -1,15 +1,87 @@
+import asyncio
+import gzip
 import io
 import logging.config
-import os
 import re
 import zipfile
 from environs import Env
 
+import orjson
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__file__)
 
+# Специальные значения колонки "Количество" из файла остатков
+_STOCK_MAP = {">10": 100, "1": 0}
+
+# Всё, что не является цифрой, — для очистки цены
+_NOT_DIGITS_RE = re.compile(r"[^0-9]")
+
+# Общая сессия с пулом keep-alive соединений к api-seller.ozon.ru.
+# HTTP/1.1 через requests выбран сознательно: политика повторов опирается
+# на urllib3, а параллелизм обеспечивают потоки в upload_*.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.2,
+            status_forcelist=[429, 500, 502, 503, 504],
+        ),
+    ),
+)
+
+# Таймауты на соединение и чтение ответа, секунды
+_TIMEOUT = (5, 30)
+
+# Сколько запросов к API выполнять одновременно при загрузке партий
+_MAX_PARALLEL_REQUESTS = 8
+
+
+def _post_json(url, payload, client_id, seller_token):
+    """
+
+    Отправить POST-запрос к API озон со сжатым JSON-телом.
+
+    Args:
+        url (str): Адрес запроса
+        payload (dict): Тело запроса, сериализуется в JSON
+        client_id (str): Идентификатор клиента для проверки подлинности пользователя
+        seller_token (str): Уникальный ключ продавца для доступа к API
+
+    Returns:
+        dict: Возвращает словарь с ответом API.
+
+    Raises:
+        requests.exceptions.HTTPError: Если запрос завершился с ошибкой (например,
+                                        код ответа 4xx или 5xx).
+
+    """
+    headers = {
+        "Client-Id": client_id,
+        "Api-Key": seller_token,
+        "Content-Type": "application/json",
+        "Content-Encoding": "gzip",
+        "Accept-Encoding": "gzip",
+    }
+    # Тела из повторяющихся JSON-полей сжимаются в разы; уровень 1 почти
+    # не нагружает процессор
+    body = orjson.dumps(payload)
+    data = gzip.compress(body, compresslevel=1)
+    response = _SESSION.post(url, data=data, headers=headers, timeout=_TIMEOUT)
+    if response.status_code == 415:
+        # Сервер не принял сжатое тело — повторим без сжатия
+        del headers["Content-Encoding"]
+        response = _SESSION.post(url, data=body, headers=headers, timeout=_TIMEOUT)
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
 
 def get_product_list(last_id, client_id, seller_token):
     """
@@ -67,12 +139,44 @@ def get_product_list(last_id, client_id, seller_token):
         "last_id": last_id,
         "limit": 1000,
     }
-    response = requests.post(url, json=payload, headers=headers)
+    response = _SESSION.post(url, json=payload, headers=headers, timeout=_TIMEOUT)
     response.raise_for_status()
-    response_object = response.json()
+    response_object = orjson.loads(response.content)
     return response_object.get("result")
 
 
+def _iter_products(client_id, seller_token):
+    """
+
+    Постранично получить товары магазина озон.
+
+    Args:
+        client_id (str): Идентификатор клиента для проверки подлинности пользователя
+        seller_token (str): Уникальный ключ продавца для доступа к API
+
+    Yields:
+        dict: Словарь с информацией об очередном товаре
+
+    """
+    last_id = ""
+    total_seen = 0
+    while True:
+        some_prod = get_product_list(last_id, client_id, seller_token)
+        items = some_prod.get("items")
+        if not items:
+            # Пустая страница — товары закончились
+            break
+        yield from items
+        total_seen += len(items)
+        prev_last_id = last_id
+        last_id = some_prod.get("last_id")
+        if some_prod.get("total") == total_seen:
+            break
+        if last_id == prev_last_id:
+            # Курсор не сдвинулся — защита от бесконечного цикла
+            break
+
+
 def get_offer_ids(client_id, seller_token):
     """
     
@@ -97,19 +201,10 @@ def get_offer_ids(client_id, seller_token):
         []
 
     """
-    last_id = ""
-    product_list = []
-    while True:
-        some_prod = get_product_list(last_id, client_id, seller_token)
-        product_list.extend(some_prod.get("items"))
-        total = some_prod.get("total")
-        last_id = some_prod.get("last_id")
-        if total == len(product_list):
-            break
-    offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer_id"))
-    return offer_ids
+    return [
+        product.get("offer_id")
+        for product in _iter_products(client_id, seller_token)
+    ]
 
 
 def update_price(prices: list, client_id, seller_token):
@@ -150,14 +245,8 @@ def update_price(prices: list, client_id, seller_token):
 
     """
     url = "https://api-seller.ozon.ru/v1/product/import/prices"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
     payload = {"prices": prices}
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return _post_json(url, payload, client_id, seller_token)
 
 
 def update_stocks(stocks: list, client_id, seller_token):
@@ -200,14 +289,8 @@ def update_stocks(stocks: list, client_id, seller_token):
 
     """
     url = "https://api-seller.ozon.ru/v1/product/import/stocks"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
     payload = {"stocks": stocks}
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return _post_json(url, payload, client_id, seller_token)
 
 
 def download_stock():
@@ -239,28 +322,46 @@ def download_stock():
         ]
 
         >>> download_stock()
-        FileNotFoundError: [Errno 2] No such file or directory
+        KeyError: "There is no item named 'ostatki.xls' in the archive"
         
     """
     # Скачать остатки с сайта
     casio_url = "https://timeworld.ru/upload/files/ostatki.zip"
-    session = requests.Session()
-    response = session.get(casio_url)
+    response = _SESSION.get(casio_url, timeout=_TIMEOUT)
     response.raise_for_status()
-    with response, zipfile.ZipFile(io.BytesIO(response.content)) as archive:
-        archive.extractall(".")
-    # Создаем список остатков часов:
-    excel_file = "ostatki.xls"
-    watch_remnants = pd.read_excel(
-        io=excel_file,
-        na_values=None,
-        keep_default_na=False,
-        header=17,
-    ).to_dict(orient="records")
-    os.remove("./ostatki.xls")  # Удалить файл
+    # Создаем список остатков часов, не извлекая архив на диск:
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        with archive.open("ostatki.xls") as excel_file:
+            watch_remnants = pd.read_excel(
+                io=io.BytesIO(excel_file.read()),
+                engine="calamine",
+                na_values=None,
+                keep_default_na=False,
+                header=17,
+            ).to_dict(orient="records")
     return watch_remnants
 
 
+def _select_known(watch_remnants, offer_set):
+    """
+
+    Отобрать строки остатков, артикулы которых есть среди товаров магазина.
+
+    Args:
+        watch_remnants (list): Cписок словарей, содержащий данные о товарах
+        offer_set (set): Множество артикулов товаров магазина
+
+    Returns:
+        tuple: Возвращает строковые артикулы отобранных строк и сами строки
+        в виде pandas.Series и pandas.DataFrame.
+
+    """
+    frame = pd.DataFrame(watch_remnants)
+    codes = frame["Код"].astype(str)
+    mask = codes.isin(offer_set)
+    return codes[mask], frame[mask]
+
+
 def create_stocks(watch_remnants, offer_ids):
     """
     
@@ -298,19 +399,24 @@ def create_stocks(watch_remnants, offer_ids):
     """
     # Уберем то, что не загружено в seller
     stocks = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append({"offer_id": str(watch.get("Код")), "stock": stock})
-            offer_ids.remove(str(watch.get("Код")))
+    offer_set = set(offer_ids)
+    seen = set()
+    if watch_remnants:
+        codes, frame = _select_known(watch_remnants, offer_set)
+        counts = frame["Количество"].astype(str)
+        counted = (
+            counts.map(_STOCK_MAP)
+            .fillna(pd.to_numeric(counts, errors="coerce"))
+            .fillna(0)
+            .astype(int)
+        )
+        stocks = [
+            {"offer_id": code, "stock": int(stock)}
+            for code, stock in zip(codes, counted)
+        ]
+        seen = set(codes)
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
+    for offer_id in offer_set - seen:
         stocks.append({"offer_id": offer_id, "stock": 0})
     return stocks
 
@@ -355,18 +461,20 @@ def create_prices(watch_remnants, offer_ids):
         []
 
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "auto_action_enabled": "UNKNOWN",
-                "currency_code": "RUB",
-                "offer_id": str(watch.get("Код")),
-                "old_price": "0",
-                "price": price_conversion(watch.get("Цена")),
-            }
-            prices.append(price)
-    return prices
+    if not watch_remnants:
+        return []
+    codes, frame = _select_known(watch_remnants, set(offer_ids))
+    values = frame["Цена"].map(price_conversion)
+    return [
+        {
+            "auto_action_enabled": "UNKNOWN",
+            "currency_code": "RUB",
+            "offer_id": code,
+            "old_price": "0",
+            "price": value,
+        }
+        for code, value in zip(codes, values)
+    ]
 
 
 def price_conversion(price: str) -> str:
@@ -394,7 +502,7 @@ def price_conversion(price: str) -> str:
         TypeError: expected string or bytes
     
     """
-    return re.sub("[^0-9]", "", price.split(".")[0])
+    return _NOT_DIGITS_RE.sub("", price.split(".", 1)[0])
 
 
 def divide(lst: list, n: int):
@@ -431,7 +539,26 @@ def divide(lst: list, n: int):
         yield lst[i : i + n]
 
 
-async def upload_prices(watch_remnants, client_id, seller_token):
+async def _bounded_call(semaphore, func, *args):
+    """
+
+    Выполнить блокирующую функцию в отдельном потоке, ограничив количество
+    одновременных вызовов семафором.
+
+    Args:
+        semaphore (asyncio.Semaphore): Ограничитель одновременных запросов
+        func (callable): Блокирующая функция для выполнения
+        *args: Аргументы, передаваемые в функцию
+
+    Returns:
+        Возвращает результат вызова функции func
+
+    """
+    async with semaphore:
+        return await asyncio.to_thread(func, *args)
+
+
+async def upload_prices(watch_remnants, client_id, seller_token, offer_ids=None):
     """
     
     Асинхронная функция, предназначена для загрузки цен
@@ -440,6 +567,8 @@ async def upload_prices(watch_remnants, client_id, seller_token):
         watch_remnants (list): Cписок словарей, содержащий данные о товарах
         client_id (str): Идентификатор клиента для проверки подлинности пользователя
         seller_token (str): Уникальный ключ продавца для доступа к API
+        offer_ids (list): Список артикулов товаров, если не передан —
+            запрашивается у API
 
     Returns:
         list: Возвращает список словарей, содержащий информацию о цене товара
@@ -474,14 +603,20 @@ async def upload_prices(watch_remnants, client_id, seller_token):
         []
 
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
+    if offer_ids is None:
+        offer_ids = get_offer_ids(client_id, seller_token)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_price in list(divide(prices, 1000)):
-        update_price(some_price, client_id, seller_token)
+    semaphore = asyncio.Semaphore(_MAX_PARALLEL_REQUESTS)
+    await asyncio.gather(
+        *(
+            _bounded_call(semaphore, update_price, some_price, client_id, seller_token)
+            for some_price in divide(prices, 1000)
+        )
+    )
     return prices
 
 
-async def upload_stocks(watch_remnants, client_id, seller_token):
+async def upload_stocks(watch_remnants, client_id, seller_token, offer_ids=None):
     """
     
     Асинхронная функция, предназначена для загрузки обновленного количества товаров
@@ -490,6 +625,8 @@ async def upload_stocks(watch_remnants, client_id, seller_token):
         watch_remnants (list): Cписок словарей, содержащий данные о товарах
         client_id (str): Идентификатор клиента для проверки подлинности пользователя
         seller_token (str): Уникальный ключ продавца для доступа к API
+        offer_ids (list): Список артикулов товаров, если не передан —
+            запрашивается у API
 
     Returns:
         list: Возвращает список словарей, содержащий артикли товаров и их остатки
@@ -519,10 +656,16 @@ async def upload_stocks(watch_remnants, client_id, seller_token):
         [], []
 
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
+    if offer_ids is None:
+        offer_ids = get_offer_ids(client_id, seller_token)
     stocks = create_stocks(watch_remnants, offer_ids)
-    for some_stock in list(divide(stocks, 100)):
-        update_stocks(some_stock, client_id, seller_token)
+    semaphore = asyncio.Semaphore(_MAX_PARALLEL_REQUESTS)
+    await asyncio.gather(
+        *(
+            _bounded_call(semaphore, update_stocks, some_stock, client_id, seller_token)
+            for some_stock in divide(stocks, 100)
+        )
+    )
     not_empty = list(filter(lambda stock: (stock.get("stock") != 0), stocks))
     return not_empty, stocks
 
@@ -532,16 +675,12 @@ def main():
     seller_token = env.str("SELLER_TOKEN")
     client_id = env.str("CLIENT_ID")
     try:
-        offer_ids = get_offer_ids(client_id, seller_token)
         watch_remnants = download_stock()
+        offer_ids = get_offer_ids(client_id, seller_token)
         # Обновить остатки
-        stocks = create_stocks(watch_remnants, offer_ids)
-        for some_stock in list(divide(stocks, 100)):
-            update_stocks(some_stock, client_id, seller_token)
+        asyncio.run(upload_stocks(watch_remnants, client_id, seller_token, offer_ids))
         # Поменять цены
-        prices = create_prices(watch_remnants, offer_ids)
-        for some_price in list(divide(prices, 900)):
-            update_price(some_price, client_id, seller_token)
+        asyncio.run(upload_prices(watch_remnants, client_id, seller_token, offer_ids))
     except requests.exceptions.ReadTimeout:
         print("Превышено время ожидания...")
     except requests.exceptions.ConnectionError as error: